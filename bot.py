@@ -3,48 +3,136 @@
 Telegram Bot Webhook Handler
 
 This script runs a simple webhook server to receive Telegram messages
-and store them in a JSON file for later processing.
+and store them in a JSON Lines file for later processing.
 
 For production use with GitHub Actions, we use Telegram's getUpdates API instead.
 This webhook handler is useful for local development and testing.
 """
 import os
-import json
 import asyncio
+from collections import deque
 from datetime import datetime
+from typing import Iterator
 from telegram import Update
 from telegram.ext import Application, MessageHandler, CommandHandler, filters, ContextTypes
 
+try:
+    import orjson
 
-# File to store pending messages
-MESSAGES_FILE = "messages.json"
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
 
+    _loads = orjson.loads
+except ImportError:
+    import json
 
-def load_messages() -> list:
-    """Load messages from JSON file."""
-    if os.path.exists(MESSAGES_FILE):
-        with open(MESSAGES_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    _loads = json.loads
+
+
+# File to store pending messages (one JSON object per line, append-only)
+MESSAGES_FILE = "messages.jsonl"
+
+# Previous storage format (a single JSON array), migrated on startup
+LEGACY_MESSAGES_FILE = "messages.json"
 
+# Write-back buffer: messages are flushed to disk in batches
+FLUSH_DELAY = 0.5  # Seconds to wait for more messages before writing
+FLUSH_THRESHOLD = 50  # Write immediately once this many messages are buffered
 
-def save_messages(messages: list):
-    """Save messages to JSON file."""
-    with open(MESSAGES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(messages, f, ensure_ascii=False, indent=2)
+_unflushed: list = []
+_unflushed_lock = asyncio.Lock()
+_dirty = asyncio.Event()
+
+# In-memory index of pending messages, so /pending never reads the file
+PENDING_PREVIEWS = 10  # Number of recent messages shown by /pending
+
+_pending_tail: deque = deque(maxlen=PENDING_PREVIEWS)
+_pending_count = 0
+
+
+def load_messages() -> Iterator[dict]:
+    """Yield messages from the JSON Lines file."""
+    if os.path.exists(MESSAGES_FILE):
+        with open(MESSAGES_FILE, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield _loads(line)
 
 
-def add_message(text: str, chat_id: int, message_id: int):
-    """Add a new message to the storage."""
-    messages = load_messages()
-    messages.append({
+def migrate_legacy_messages():
+    """Move messages from the old JSON array file into the JSON Lines file."""
+    if not os.path.exists(LEGACY_MESSAGES_FILE):
+        return
+    with open(LEGACY_MESSAGES_FILE, 'rb') as f:
+        messages = _loads(f.read())
+    if messages:
+        with open(MESSAGES_FILE, 'ab') as f:
+            f.write(b"".join(_dumps(record) + b"\n" for record in messages))
+    os.remove(LEGACY_MESSAGES_FILE)
+    print(f"📦 Migrated {len(messages)} messages from {LEGACY_MESSAGES_FILE}")
+
+
+def preview(text: str) -> str:
+    """Shorten a message for display in /pending."""
+    return text[:50] + "..." if len(text) > 50 else text
+
+
+def load_pending_index():
+    """Rebuild the pending messages index from the file."""
+    global _pending_count
+    _pending_tail.clear()
+    _pending_count = 0
+    for msg in load_messages():
+        if not msg.get("processed"):
+            _pending_count += 1
+            _pending_tail.append(preview(msg["text"]))
+
+
+def clear_messages():
+    """Truncate the messages file."""
+    open(MESSAGES_FILE, 'wb').close()
+
+
+async def flush_messages():
+    """Append all buffered messages to the file in a single write."""
+    async with _unflushed_lock:
+        if not _unflushed:
+            return
+        data = b"".join(_dumps(record) + b"\n" for record in _unflushed)
+        _unflushed.clear()
+        with open(MESSAGES_FILE, 'ab') as f:
+            f.write(data)
+
+
+async def flush_loop():
+    """Background task: write buffered messages shortly after they arrive."""
+    while True:
+        await _dirty.wait()
+        _dirty.clear()
+        # Give other messages a chance to arrive and share the write
+        if len(_unflushed) < FLUSH_THRESHOLD:
+            await asyncio.sleep(FLUSH_DELAY)
+        await flush_messages()
+
+
+async def add_message(text: str, chat_id: int, message_id: int):
+    """Add a new message to the write-back buffer and the pending index."""
+    global _pending_count
+    record = {
         "text": text,
         "chat_id": chat_id,
         "message_id": message_id,
         "timestamp": datetime.now().isoformat(),
         "processed": False
-    })
-    save_messages(messages)
+    }
+    async with _unflushed_lock:
+        _unflushed.append(record)
+        _pending_count += 1
+        _pending_tail.append(preview(text))
+    _dirty.set()
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -62,27 +150,28 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /pending command - show pending messages."""
-    messages = load_messages()
-    pending = [m for m in messages if not m.get("processed")]
-    
-    if not pending:
+    if not _pending_count:
         await update.message.reply_text("📭 No hay mensajes pendientes.")
         return
     
-    text = f"📬 <b>Mensajes pendientes: {len(pending)}</b>\n\n"
-    for i, msg in enumerate(pending[-10:], 1):  # Show last 10
-        preview = msg["text"][:50] + "..." if len(msg["text"]) > 50 else msg["text"]
-        text += f"{i}. {preview}\n"
+    text = f"📬 <b>Mensajes pendientes: {_pending_count}</b>\n\n"
+    for i, message_preview in enumerate(_pending_tail, 1):  # Show last 10
+        text += f"{i}. {message_preview}\n"
     
-    if len(pending) > 10:
-        text += f"\n<i>...y {len(pending) - 10} más</i>"
+    if _pending_count > PENDING_PREVIEWS:
+        text += f"\n<i>...y {_pending_count - PENDING_PREVIEWS} más</i>"
     
     await update.message.reply_html(text)
 
 
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /clear command - clear all pending messages."""
-    save_messages([])
+    global _pending_count
+    async with _unflushed_lock:
+        _unflushed.clear()
+        _pending_tail.clear()
+        _pending_count = 0
+        clear_messages()
     await update.message.reply_text("🧹 Mensajes pendientes eliminados.")
 
 
@@ -93,12 +182,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not message or not message.text:
         return
     
-    # Ignore messages that are commands
-    if message.text.startswith("/"):
-        return
-    
     # Store the message
-    add_message(
+    await add_message(
         text=message.text,
         chat_id=message.chat.id,
         message_id=message.message_id
@@ -108,6 +193,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await message.reply_text("✅ Guardado para Anki")
 
 
+async def post_init(app: Application):
+    """Load the pending messages index and start the background flush task."""
+    migrate_legacy_messages()
+    load_pending_index()
+    app.bot_data["flush_task"] = asyncio.create_task(flush_loop())
+
+
+async def post_shutdown(app: Application):
+    """Stop the flush task and write any messages still in the buffer."""
+    task = app.bot_data.pop("flush_task", None)
+    if task:
+        task.cancel()
+    await flush_messages()
+
+
 def main():
     """Run the bot."""
     token = os.environ.get("TELEGRAM_BOT_TOKEN")
@@ -121,16 +221,23 @@ def main():
     print("Send /start to the bot to begin.")
     
     # Create application
-    app = Application.builder().token(token).build()
+    app = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Add handlers
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("pending", pending_command))
     app.add_handler(CommandHandler("clear", clear_command))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message, block=False))
     
-    # Run bot
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Run bot (only message updates are handled, so don't fetch anything else)
+    app.run_polling(allowed_updates=[Update.MESSAGE])
 
 
 if __name__ == "__main__":
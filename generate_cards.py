@@ -4,21 +4,76 @@ Main script to generate Anki cards from Telegram messages.
 
 This script:
 1. Fetches pending messages from Telegram
-2. Uses Gemini to generate flashcards
-3. Creates an Anki deck file (.apkg)
+2. Uses Gemini to generate flashcards, adding them to an Anki deck as they arrive
+3. Saves the Anki deck file (.apkg)
 4. Uploads to Google Drive
 5. Cleans up processed messages
 """
 import os
 import sys
+import asyncio
 from datetime import datetime
+from typing import List
 
-from src.telegram_client import TelegramClient, get_pending_messages_from_file, clear_pending_messages_file
+from aiolimiter import AsyncLimiter
+
+from src.telegram_client import TelegramClient
 from src.gemini_client import GeminiClient
 from src.anki_generator import AnkiGenerator
 from src.drive_uploader import DriveUploader
 
 
+# Gemini request limits: max in-flight requests and max requests per second
+GEMINI_CONCURRENCY = 8
+GEMINI_REQUESTS_PER_SECOND = 4
+
+# Number of texts sent to Gemini in a single request
+GEMINI_BATCH_SIZE = 10
+
+
+async def generate_all_cards(gemini: GeminiClient, texts: List[str], queue: asyncio.Queue):
+    """
+    Generate cards for all texts concurrently.
+    
+    The cards of each batch are put on the queue as soon as the batch is done.
+    """
+    semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+    batches = [texts[i:i + GEMINI_BATCH_SIZE] for i in range(0, len(texts), GEMINI_BATCH_SIZE)]
+    
+    async def sem_call(i: int, batch: List[str]):
+        async with semaphore:
+            results = await gemini.generate_cards_multi(batch)
+        cards = [card for text_cards in results for card in text_cards]
+        print(f"  Processed batch {i}/{len(batches)} ({len(batch)} messages) → {len(cards)} cards")
+        await queue.put(cards)
+    
+    await asyncio.gather(*(sem_call(i, batch) for i, batch in enumerate(batches, 1)))
+
+
+async def build_deck(gemini: GeminiClient, anki: AnkiGenerator, texts: List[str]) -> int:
+    """
+    Generate cards and add them to the deck while other batches are in flight.
+    
+    Returns count of cards added to the deck.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def produce():
+        try:
+            await generate_all_cards(gemini, texts, queue)
+        finally:
+            await queue.put(None)  # Tell the consumer there are no more cards
+    
+    async def consume() -> int:
+        added = 0
+        while (cards := await queue.get()) is not None:
+            added += anki.add_cards(cards)
+        return added
+    
+    _, added = await asyncio.gather(produce(), consume())
+    return added
+
+
 def main():
     # Load environment variables
     telegram_token = os.environ.get("TELEGRAM_BOT_TOKEN")
@@ -50,11 +105,8 @@ def main():
     telegram = TelegramClient(telegram_token, telegram_chat_id)
     messages = telegram.get_messages()
     
-    # Also check for locally stored messages (backup mechanism)
-    pending_file = "pending_messages.txt"
-    local_messages = get_pending_messages_from_file(pending_file)
-    
-    all_texts = [m["text"] for m in messages] + [m["text"] for m in local_messages]
+    # Skip exact duplicates (e.g. the same fact forwarded twice)
+    all_texts = list(dict.fromkeys(m["text"] for m in messages))
     
     if not all_texts:
         print("ℹ️  No new messages to process.")
@@ -63,29 +115,26 @@ def main():
     
     print(f"📝 Found {len(all_texts)} messages to process")
     
-    # Step 2: Generate cards with Gemini
+    # Step 2: Generate cards with Gemini, building the deck as they arrive
     print("\n✨ Generating flashcards with Gemini...")
-    gemini = GeminiClient(gemini_api_key)
-    all_cards = []
-    
-    for i, text in enumerate(all_texts, 1):
-        print(f"  Processing {i}/{len(all_texts)}: {text[:50]}...")
-        cards = gemini.generate_cards(text)
-        all_cards.extend(cards)
-        print(f"    → Generated {len(cards)} cards")
+    # The rate limit is applied by the client to every request, including
+    # per-text fallbacks and retries
+    gemini = GeminiClient(gemini_api_key, limiter=AsyncLimiter(GEMINI_REQUESTS_PER_SECOND, 1))
+    anki = AnkiGenerator(deck_name="Datos")
+    try:
+        added = asyncio.run(build_deck(gemini, anki, all_texts))
+    finally:
+        gemini.close()
     
-    if not all_cards:
+    if not added:
         print("⚠️  No cards were generated.")
         telegram.send_message("⚠️ No se pudieron generar tarjetas esta semana.")
         return
     
-    print(f"\n📚 Total cards generated: {len(all_cards)}")
-    
-    # Step 3: Create Anki deck
-    print("\n📦 Creating Anki deck...")
-    anki = AnkiGenerator(deck_name="Datos")
-    added = anki.add_cards(all_cards)
+    print(f"\n📚 Total cards generated: {added}")
     
+    # Step 3: Save Anki deck
+    print("\n📦 Saving Anki deck...")
     filename = anki.generate_filename()
     output_path = f"/tmp/{filename}"
     anki.save(output_path)
@@ -94,28 +143,31 @@ def main():
     # Step 4: Upload to Google Drive
     print("\n☁️  Uploading to Google Drive...")
     drive = DriveUploader(gdrive_credentials, gdrive_folder_id)
-    file_id = drive.upload_file(output_path, filename)
+    # Filenames are dated, so the first attempt of the weekly scheduled run
+    # can skip the lookup; manual runs and reruns may hit today's file
+    scheduled_first_attempt = (
+        os.environ.get("GITHUB_EVENT_NAME") == "schedule"
+        and os.environ.get("GITHUB_RUN_ATTEMPT", "1") == "1"
+    )
+    file_id = drive.upload_file(output_path, filename, overwrite=not scheduled_first_attempt)
     print(f"✅ Uploaded to Drive (ID: {file_id})")
     
     # Step 5: Cleanup
     print("\n🧹 Cleaning up...")
     
-    # Delete processed Telegram messages
-    deleted_count = 0
-    for msg in messages:
-        if msg.get("id"):
-            if telegram.delete_message(msg["id"]):
-                deleted_count += 1
+    # Confirm the fetched updates so next week's run starts after them
+    telegram.acknowledge_updates()
     
-    # Clear local pending file
-    clear_pending_messages_file(pending_file)
+    # Delete processed Telegram messages
+    message_ids = [msg["id"] for msg in messages if msg.get("id")]
+    deleted_count = asyncio.run(telegram.delete_messages(message_ids))
     
     print(f"✅ Deleted {deleted_count} messages from Telegram")
     
     # Send confirmation
     telegram.send_message(
         f"✅ <b>Telegram2Anki</b>\n\n"
-        f"Se generaron <b>{len(all_cards)}</b> tarjetas nuevas.\n"
+        f"Se generaron <b>{added}</b> tarjetas nuevas.\n"
         f"Archivo: <code>{filename}</code>\n\n"
         f"Sincroniza FolderSync para importar."
     )
@@ -3,10 +3,20 @@ Anki deck generator using genanki library.
 """
 import genanki
 import random
+from operator import itemgetter
 from typing import List, Dict
 from datetime import datetime
 
 
+# Buffer size for writing .apkg files
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+# Field extractors for each card type
+BASIC_FIELDS = itemgetter("front", "back")
+CLOZE_FIELDS = itemgetter("text")
+
+
 # Unique IDs for the deck and models (must stay constant)
 DECK_ID = 1607392319
 BASIC_MODEL_ID = 1607392320
@@ -112,11 +122,15 @@ class AnkiGenerator:
     
     def add_cards(self, cards: List[Dict]) -> int:
         """Add multiple cards to the deck. Returns count of successfully added cards."""
-        count = 0
-        for card in cards:
-            if self.add_card(card):
-                count += 1
-        return count
+        # Validate keys up front so notes can be built without per-card try/except
+        basics = [c for c in cards if c.get("type") == "basic" and "front" in c and "back" in c]
+        clozes = [c for c in cards if c.get("type") == "cloze" and "text" in c]
+        
+        notes = [genanki.Note(model=BASIC_MODEL, fields=list(BASIC_FIELDS(c))) for c in basics]
+        notes += [genanki.Note(model=CLOZE_MODEL, fields=[CLOZE_FIELDS(c), ""]) for c in clozes]
+        
+        self.deck.notes.extend(notes)
+        return len(notes)
     
     def save(self, filepath: str) -> str:
         """
@@ -125,7 +139,10 @@ class AnkiGenerator:
         Returns the filepath if successful.
         """
         package = genanki.Package(self.deck)
-        package.write_to_file(filepath)
+        # genanki zips into any file object; a large buffer coalesces the
+        # many small writes made by zipfile into a few syscalls
+        with open(filepath, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+            package.write_to_file(f)
         return filepath
     
     def generate_filename(self) -> str:
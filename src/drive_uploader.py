@@ -2,7 +2,7 @@
 Google Drive uploader for Anki deck files.
 """
 import os
-import json
+import orjson
 from typing import Optional
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
@@ -11,6 +11,11 @@ from googleapiclient.http import MediaFileUpload
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
+# Files up to this size are sent in a single multipart request;
+# larger ones use a resumable upload in chunks
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class DriveUploader:
     """Upload files to Google Drive."""
@@ -23,20 +28,29 @@ class DriveUploader:
             credentials_json: JSON string of service account credentials
             folder_id: Optional folder ID to upload to (uses root if not specified)
         """
-        creds_dict = json.loads(credentials_json)
+        creds_dict = orjson.loads(credentials_json)
         credentials = service_account.Credentials.from_service_account_info(
             creds_dict, scopes=SCOPES
         )
-        self.service = build('drive', 'v3', credentials=credentials)
+        # Already the default in google-api-python-client 2.x; spelled out so
+        # the bundled discovery document is used even if that default changes
+        self.service = build(
+            'drive', 'v3',
+            credentials=credentials,
+            cache_discovery=False,
+            static_discovery=True
+        )
         self.folder_id = folder_id
     
-    def upload_file(self, filepath: str, filename: Optional[str] = None) -> str:
+    def upload_file(self, filepath: str, filename: Optional[str] = None, overwrite: bool = False) -> str:
         """
         Upload a file to Google Drive.
         
         Args:
             filepath: Local path to the file
             filename: Name to use in Drive (defaults to original filename)
+            overwrite: Replace an existing file with the same name instead of
+                creating a new one (costs an extra lookup request)
         
         Returns:
             File ID of the uploaded file
@@ -50,12 +64,14 @@ class DriveUploader:
             file_metadata['parents'] = [self.folder_id]
         
         # Check if file already exists, update if so
-        existing_file_id = self._find_file(filename)
+        existing_file_id = self._find_file(filename) if overwrite else None
         
+        resumable = os.path.getsize(filepath) > RESUMABLE_THRESHOLD
         media = MediaFileUpload(
             filepath,
             mimetype='application/octet-stream',
-            resumable=True
+            chunksize=UPLOAD_CHUNK_SIZE,
+            resumable=resumable
         )
         
         if existing_file_id:
@@ -1,15 +1,38 @@
 """
 Gemini API client for generating Anki flashcards from text.
 """
-import json
+import re
+import shelve
+import contextlib
+import hashlib
+import json5
+import orjson
 import google.generativeai as genai
-from typing import List, Dict, Optional
+from google.api_core import exceptions as google_exceptions
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from typing import Annotated, List, Dict, Literal, Optional, Union
 
 
-CARD_GENERATION_PROMPT = """Eres un experto en crear tarjetas de memoria (flashcards) efectivas para Anki.
+MODEL_NAME = 'gemini-2.5-flash'
 
-Dado el siguiente dato curioso o información, genera una o más tarjetas de Anki.
-Usa el formato que mejor se adapte al contenido:
+# Local cache of generated cards, keyed by a hash of the source text
+RESPONSE_CACHE_FILE = ".gemini_cache.db"
+# Bump when the card schema changes so cached cards are regenerated
+RESPONSE_CACHE_VERSION = 1
+
+
+# Errors worth retrying: rate limits, server errors and timeouts
+TRANSIENT_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+# Instructions shared by the single and batch prompts
+CARD_RULES = """Usa el formato que mejor se adapte al contenido:
 
 1. **Pregunta/Respuesta (basic)**: Para hechos directos, fechas, definiciones simples
 2. **Cloze (texto con huecos)**: Para definiciones con contexto, frases donde hay que recordar un elemento clave
@@ -21,7 +44,13 @@ REGLAS:
 - Para cloze, usa el formato {{c1::texto a ocultar}}
 - Genera entre 1 y 3 tarjetas según la complejidad del dato
 - Las tarjetas deben estar en el mismo idioma que el dato original
+"""
+
 
+CARD_GENERATION_PROMPT = """Eres un experto en crear tarjetas de memoria (flashcards) efectivas para Anki.
+
+Dado el siguiente dato curioso o información, genera una o más tarjetas de Anki.
+""" + CARD_RULES + """
 Responde ÚNICAMENTE con JSON válido en este formato exacto:
 {
   "cards": [
@@ -30,51 +59,143 @@ Responde ÚNICAMENTE con JSON válido en este formato exacto:
   ]
 }
 
-DATO A CONVERTIR:
+El mensaje del usuario es el dato a convertir.
+"""
+
+
+BATCH_GENERATION_PROMPT = """Eres un experto en crear tarjetas de memoria (flashcards) efectivas para Anki.
+
+Recibirás una lista JSON de datos curiosos. Para cada dato, genera una o más tarjetas de Anki.
+""" + CARD_RULES + """
+Responde ÚNICAMENTE con JSON válido en este formato exacto, con un objeto por dato
+e "index" igual a la posición del dato en la lista (empezando en 0):
+{
+  "results": [
+    {
+      "index": 0,
+      "cards": [
+        {"type": "basic", "front": "pregunta aquí", "back": "respuesta aquí"},
+        {"type": "cloze", "text": "La capital de Francia es {{c1::París}}"}
+      ]
+    }
+  ]
+}
+
+El mensaje del usuario es la lista JSON de datos a convertir.
 """
 
 
+# Outermost {...} block of a response, skipping markdown fences and surrounding prose
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.S)
+
+
+def _parse_response(text: str) -> Dict:
+    """
+    Parse the JSON object in a model response.
+    
+    Tries the strict (and fast) orjson parser first, then json5, which tolerates
+    trailing commas and similar slips. Raises ValueError if both fail.
+    """
+    match = JSON_OBJECT_RE.search(text)
+    if not match:
+        raise ValueError("No JSON object found in response")
+    
+    raw = match.group(0)
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json5.loads(raw)
+
+
+# Cached cards are only reused with the same model, prompts and schema version
+_PROMPTS_HASH = hashlib.blake2b(
+    (CARD_GENERATION_PROMPT + BATCH_GENERATION_PROMPT).encode(), digest_size=8
+).hexdigest()
+_CACHE_KEY_PREFIX = f"v{RESPONSE_CACHE_VERSION}:{MODEL_NAME}:{_PROMPTS_HASH}:"
+
+
+def _cache_key(text: str) -> str:
+    """Hash a source text into a response cache key."""
+    return _CACHE_KEY_PREFIX + hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class BasicCard(BaseModel):
+    """Question/answer card."""
+    type: Literal["basic"]
+    front: str = Field(min_length=1)
+    back: str = Field(min_length=1)
+
+
+class ClozeCard(BaseModel):
+    """Cloze deletion card; the text must contain at least one {{cN::...}}."""
+    type: Literal["cloze"]
+    text: str = Field(pattern=r'\{\{c\d+::')
+
+
+Card = Annotated[Union[BasicCard, ClozeCard], Field(discriminator="type")]
+CARDS_ADAPTER = TypeAdapter(List[Card])
+
+
+def _validate_cards(cards: List[Dict]) -> List[Dict]:
+    """Keep only cards with the fields required by their type."""
+    try:
+        return [card.model_dump() for card in CARDS_ADAPTER.validate_python(cards)]
+    except ValidationError as e:
+        # Drop the rows that failed and validate the rest again
+        invalid = {error["loc"][0] for error in e.errors() if error["loc"]}
+        if not invalid or not isinstance(cards, list):
+            return []
+        valid = [card for i, card in enumerate(cards) if i not in invalid]
+        return [card.model_dump() for card in CARDS_ADAPTER.validate_python(valid)]
+
+
 class GeminiClient:
     """Client for Gemini API to generate flashcards."""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache_file: str = RESPONSE_CACHE_FILE, limiter=None):
+        """
+        Args:
+            api_key: Gemini API key
+            cache_file: Path of the local response cache
+            limiter: Optional async context manager (e.g. an AsyncLimiter)
+                entered around every API request, including retries
+        """
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self._limiter = limiter or contextlib.nullcontext()
+        self._response_cache = shelve.open(cache_file)
+        # Prompt instructions go in the system instruction, so each request
+        # only carries the text(s) to convert
+        self.model = genai.GenerativeModel(MODEL_NAME, system_instruction=CARD_GENERATION_PROMPT)
+        self.batch_model = genai.GenerativeModel(MODEL_NAME, system_instruction=BATCH_GENERATION_PROMPT)
     
-    def generate_cards(self, text: str) -> List[Dict]:
+    def close(self):
+        """Close the response cache."""
+        self._response_cache.close()
+    
+    async def generate_cards(self, text: str) -> List[Dict]:
         """
         Generate Anki cards from a piece of text.
         
         Returns a list of card dictionaries with 'type', 'front'/'back' or 'text'.
         """
+        key = _cache_key(text)
+        if key in self._response_cache:
+            return self._response_cache[key]
+        
+        response_text = ""
         try:
-            prompt = CARD_GENERATION_PROMPT + text
-            response = self.model.generate_content(prompt)
+            response = await self._generate_content(self.model, text)
             
             # Extract JSON from response
-            response_text = response.text.strip()
-            
-            # Handle markdown code blocks if present
-            if response_text.startswith("```"):
-                lines = response_text.split("\n")
-                response_text = "\n".join(lines[1:-1])
-            
-            data = json.loads(response_text)
-            cards = data.get("cards", [])
-            
-            # Validate card structure
-            valid_cards = []
-            for card in cards:
-                if card.get("type") == "basic":
-                    if card.get("front") and card.get("back"):
-                        valid_cards.append(card)
-                elif card.get("type") == "cloze":
-                    if card.get("text") and "{{c1::" in card.get("text", ""):
-                        valid_cards.append(card)
-            
-            return valid_cards
+            response_text = response.text
+            data = _parse_response(response_text)
+            cards = _validate_cards(data.get("cards", []))
+            # Don't cache empty results, so the text is retried next time
+            if cards:
+                self._response_cache[key] = cards
+            return cards
             
-        except json.JSONDecodeError as e:
+        except ValueError as e:
             print(f"Error parsing Gemini response: {e}")
             print(f"Response was: {response_text[:500]}")
             return []
@@ -82,11 +203,71 @@ class GeminiClient:
             print(f"Error generating cards: {e}")
             return []
     
-    def generate_cards_batch(self, texts: List[str]) -> List[Dict]:
-        """Generate cards for multiple texts."""
+    async def generate_cards_multi(self, texts: List[str]) -> List[List[Dict]]:
+        """
+        Generate Anki cards for several texts in a single request.
+        
+        Returns one list of cards per text, in the same order as the input.
+        Texts already in the response cache are not sent.
+        """
+        results = [self._response_cache.get(_cache_key(text)) for text in texts]
+        missing = [i for i, cards in enumerate(results) if cards is None]
+        
+        if missing:
+            chunk_results = await self._generate_cards_chunk([texts[i] for i in missing])
+            for i, cards in zip(missing, chunk_results):
+                results[i] = cards
+        return results
+    
+    async def _generate_cards_chunk(self, texts: List[str]) -> List[List[Dict]]:
+        """Generate cards for texts in a single request, falling back to one request per text."""
+        try:
+            response = await self._generate_content(self.batch_model, orjson.dumps(texts).decode())
+        except Exception as e:
+            print(f"Error generating cards: {e}")
+            return [[] for _ in texts]
+        
+        try:
+            data = _parse_response(response.text)
+            results = [[] for _ in texts]
+            answered = set()
+            for item in data["results"]:
+                index = item["index"]
+                if isinstance(index, int) and 0 <= index < len(texts):
+                    answered.add(index)
+                    results[index] = _validate_cards(item.get("cards", []))
+                    if results[index]:
+                        self._response_cache[_cache_key(texts[index])] = results[index]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Error parsing Gemini batch response, retrying one by one: {e}")
+            return [await self.generate_cards(text) for text in texts]
+        
+        # Texts the model left out of its answer get their own request
+        skipped = [i for i in range(len(texts)) if i not in answered]
+        if skipped:
+            print(f"Gemini batch response skipped {len(skipped)} texts, retrying them one by one")
+            for i in skipped:
+                results[i] = await self.generate_cards(texts[i])
+        return results
+    
+    @retry(
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(5),
+        retry=retry_if_exception_type(TRANSIENT_ERRORS),
+        reraise=True,
+    )
+    async def _generate_content(self, model: genai.GenerativeModel, contents: str):
+        """Call the model, retrying transient failures with exponential backoff."""
+        async with self._limiter:
+            return await model.generate_content_async(contents)
+    
+    async def generate_cards_batch(self, texts: List[str], batch_size: int = 10) -> List[Dict]:
+        """Generate cards for multiple texts, sending up to batch_size texts per request."""
+        results = []
+        for start in range(0, len(texts), batch_size):
+            results.extend(await self.generate_cards_multi(texts[start:start + batch_size]))
         all_cards = []
-        for text in texts:
-            cards = self.generate_cards(text)
+        for text, cards in zip(texts, results):
             for card in cards:
                 card["source_text"] = text
             all_cards.extend(cards)
@@ -1,12 +1,73 @@
 """
 Telegram client for fetching and managing messages from the bot.
 """
-import os
+import asyncio
+import httpx
+import orjson
 import requests
+from aiolimiter import AsyncLimiter
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 
 
+# Timeouts in seconds for Bot API requests: (connect, read)
+REQUEST_TIMEOUT = (3.05, 27)
+
+# Maximum number of updates returned by a single getUpdates call
+UPDATES_PAGE_SIZE = 100
+
+# Telegram allows about 30 requests per second per bot; stay below that
+DELETES_PER_SECOND = 25
+
+
+class RetryAfter(Exception):
+    """Telegram answered 429 Too Many Requests."""
+    
+    def __init__(self, retry_after: float):
+        super().__init__(f"Flood control, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+_backoff = wait_random_exponential(min=1, max=60)
+
+
+def _wait_retry_after(retry_state) -> float:
+    """Wait as long as Telegram asks on 429, otherwise back off exponentially."""
+    error = retry_state.outcome.exception()
+    if isinstance(error, RetryAfter):
+        return error.retry_after
+    return _backoff(retry_state)
+
+
+def _raise_for_transient(response):
+    """Raise for responses worth retrying (429 and 5xx). Works with requests and httpx."""
+    if response.status_code == 429:
+        try:
+            retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+        except ValueError:
+            retry_after = 1
+        raise RetryAfter(retry_after)
+    if response.status_code >= 500:
+        response.raise_for_status()
+
+
+telegram_retry = retry(
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type((
+        RetryAfter,
+        requests.Timeout,
+        requests.ConnectionError,
+        requests.HTTPError,
+        httpx.TransportError,
+        httpx.HTTPStatusError,
+    )),
+    reraise=True,
+)
+
+
 class TelegramClient:
     """Client to interact with Telegram Bot API."""
     
@@ -14,79 +75,141 @@ class TelegramClient:
         self.bot_token = bot_token
         self.chat_id = chat_id
         self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        self.last_update_id = None
+        # Reuse connections across calls instead of a new TLS handshake each time
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+        self.session.mount("https://", adapter)
     
     def get_messages(self, since_days: int = 7) -> List[Dict]:
         """
         Fetch messages from the bot's chat history.
         
         Note: Telegram Bot API doesn't provide direct message history access.
-        We use getUpdates which stores messages for 24 hours.
-        For longer storage, we'll use a simple file-based approach.
+        We page through getUpdates (which stores messages for 24 hours) until
+        no updates are left. Requesting the next page confirms the previous
+        ones; call acknowledge_updates() after processing to confirm the last.
         """
         messages = []
+        offset = None
         
-        # Try to get updates (works for recent messages)
-        response = requests.get(
-            f"{self.base_url}/getUpdates",
-            params={"offset": -100, "limit": 100}
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("ok"):
-                for update in data.get("result", []):
-                    message = update.get("message", {})
-                    if message.get("chat", {}).get("id") == int(self.chat_id):
-                        text = message.get("text", "")
-                        if text and not text.startswith("/"):
-                            messages.append({
-                                "id": message.get("message_id"),
-                                "text": text,
-                                "date": datetime.fromtimestamp(message.get("date", 0))
-                            })
+        while True:
+            params = {"limit": UPDATES_PAGE_SIZE, "timeout": 0}
+            if offset is not None:
+                params["offset"] = offset
+            
+            response = self.session.get(
+                f"{self.base_url}/getUpdates",
+                params=params,
+                timeout=REQUEST_TIMEOUT
+            )
+            if response.status_code != 200:
+                break
+            
+            data = orjson.loads(response.content)
+            updates = data.get("result", []) if data.get("ok") else []
+            if not updates:
+                break
+            
+            for update in updates:
+                message = update.get("message", {})
+                if message.get("chat", {}).get("id") == int(self.chat_id):
+                    text = message.get("text", "")
+                    if text and not text.startswith("/"):
+                        messages.append({
+                            "id": message.get("message_id"),
+                            "text": text,
+                            "date": datetime.fromtimestamp(message.get("date", 0))
+                        })
+            
+            self.last_update_id = max(update["update_id"] for update in updates)
+            offset = self.last_update_id + 1
+            
+            # A short page means we've caught up
+            if len(updates) < UPDATES_PAGE_SIZE:
+                break
         
         return messages
     
+    def acknowledge_updates(self) -> bool:
+        """Confirm all fetched updates so getUpdates won't return them again."""
+        if self.last_update_id is None:
+            return True
+        try:
+            response = self._post("getUpdates", {
+                "offset": self.last_update_id + 1,
+                "limit": 1,
+                "timeout": 0
+            })
+        except (requests.RequestException, RetryAfter) as e:
+            print(f"Error acknowledging updates: {e}")
+            return False
+        return response.status_code == 200
+    
+    @telegram_retry
+    def _post(self, method: str, payload: Dict) -> requests.Response:
+        """Call a Bot API method, retrying rate limits and server errors."""
+        response = self.session.post(f"{self.base_url}/{method}", json=payload, timeout=REQUEST_TIMEOUT)
+        _raise_for_transient(response)
+        return response
+    
     def send_message(self, text: str) -> bool:
         """Send a message to the chat."""
-        response = requests.post(
-            f"{self.base_url}/sendMessage",
-            json={
+        try:
+            response = self._post("sendMessage", {
                 "chat_id": self.chat_id,
                 "text": text,
                 "parse_mode": "HTML"
-            }
-        )
+            })
+        except (requests.RequestException, RetryAfter) as e:
+            print(f"Error sending message: {e}")
+            return False
         return response.status_code == 200
     
-    def delete_message(self, message_id: int) -> bool:
+    def _async_client(self) -> httpx.AsyncClient:
+        """Create a keep-alive HTTP/2 client for concurrent calls; use with async with."""
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=10),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT[1], connect=REQUEST_TIMEOUT[0])
+        )
+    
+    @telegram_retry
+    async def _post_async(self, client: httpx.AsyncClient, method: str, payload: Dict) -> httpx.Response:
+        """Async variant of _post using the given client."""
+        response = await client.post(f"{self.base_url}/{method}", json=payload)
+        _raise_for_transient(response)
+        return response
+    
+    async def delete_message(self, message_id: int) -> bool:
         """Delete a message from the chat."""
-        response = requests.post(
-            f"{self.base_url}/deleteMessage",
-            json={
+        async with self._async_client() as client:
+            return await self._delete_message(client, message_id)
+    
+    async def delete_messages(self, message_ids: List[int]) -> int:
+        """
+        Delete messages concurrently over a shared connection pool.
+        
+        Returns count of deleted messages.
+        """
+        limiter = AsyncLimiter(DELETES_PER_SECOND, 1)
+        
+        async with self._async_client() as client:
+            async def limited_delete(message_id: int) -> bool:
+                async with limiter:
+                    return await self._delete_message(client, message_id)
+            
+            results = await asyncio.gather(*(limited_delete(m) for m in message_ids))
+        return sum(results)
+    
+    async def _delete_message(self, client: httpx.AsyncClient, message_id: int) -> bool:
+        """Delete a message using the given client."""
+        try:
+            response = await self._post_async(client, "deleteMessage", {
                 "chat_id": self.chat_id,
                 "message_id": message_id
-            }
-        )
+            })
+        except (httpx.HTTPError, RetryAfter) as e:
+            print(f"Error deleting message {message_id}: {e}")
+            return False
         return response.status_code == 200
-
-
-def get_pending_messages_from_file(filepath: str) -> List[Dict]:
-    """
-    Read pending messages from a local file.
-    This is used as a workaround for Telegram's 24-hour update limit.
-    """
-    messages = []
-    if os.path.exists(filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    messages.append({"text": line, "id": None})
-    return messages
-
-
-def clear_pending_messages_file(filepath: str):
-    """Clear the pending messages file after processing."""
-    if os.path.exists(filepath):
-        os.remove(filepath)